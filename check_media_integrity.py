@@ -9,13 +9,17 @@
 - **递归遍历**：支持多级目录递归扫描图片与视频。
 - **三档检测模式**：
   - fast（快）：仅做**容器/元数据探测**（ffprobe & exiftool），不实际解码像素。速度最快，但可能漏检深层损坏。
-  - medium（中）：在 fast 的基础上，利用 **ffmpeg 解码首帧**（图像或视频），能发现多数解码层面的错误。
+  - medium（中）：利用 **ffmpeg 解码首帧**（图像或视频），同一次调用中的打开/解复用报错即反映容器是否可读，能发现多数解码层面的错误；
+    加 --strict-metadata 时额外执行 fast 的 ffprobe/exiftool 探测。
   - slow（慢）：对视频做 **全轨道完整解码**（所有帧/音频样本）至空设备（-f null -），最严格但最慢；图像与 medium 等效（单帧已完整）。
+- **文件头预检**：所有模式先读取文件头前 64 字节：头部明显无效（空文件、过短、全零）即判损坏，不再启动外部工具；
+  其余文件照常交给外部工具检测（魔数相符不代表容器完整，如缺少 moov 的截断 MP4）。
 - **进度显示**：主线程汇总完成数与百分比，实时输出。
 - **多线程**：ThreadPoolExecutor 并行执行文件检查任务（默认 worker 与 CPU 核数相关，可自定义）。
 - **中文路径**：基于 Python 3 的 Unicode 字符串与子进程参数传递，良好支持中文文件名。
 - **外部工具**：
   - 依赖 `ffprobe/ffmpeg`（来自 FFmpeg），和 `exiftool`（已在 PATH 中）。
+  - 可选依赖 PyAV（`pip install av`）：加 --pyav 后 fast 探测改为进程内打开容器，省去每个文件一次 ffprobe 进程启动。
 
 用法示例：
     python check_media_integrity.py \
@@ -32,97 +36,430 @@
 - --timeout SECONDS     单文件检测超时，避免卡死（默认：120 秒）
 - --include-exts CSV    自定义扩展名（逗号分隔，不区分大小写）。未提供则使用内置常见图片/视频扩展名。
 - --list-damaged        检测结束后逐行列出损坏文件的详细原因
+- --ffmpeg-threads N    slow 模式下每个 ffmpeg 的解码线程数（默认 0：交由 ffmpeg 自动决定）
+- --strict-metadata     medium/slow 模式下仍单独执行 fast 的容器/元数据探测（ffprobe/exiftool）
+- --cache-db PATH       跨次运行的结果缓存（SQLite，默认 ~/.cache/check_media_integrity.sqlite3）：
+                        大小/修改时间未变、且在相同检测参数（模式、--strict-metadata、--pyav）下上次判定 OK 的文件直接跳过
+- --no-cache            不读取也不写入结果缓存
+- --hdd-parallelism N   每块机械硬盘同时在检的文件数上限（默认 2；0 表示不限制）；按文件所在设备分别计数
+- --mem-limit MB        单个外部工具进程的内存上限（Linux：RLIMIT_AS；Windows：作业对象），默认 0 不限制
+- --evict-cache         每个文件检测完后通知内核丢弃其页缓存（posix_fadvise DONTNEED，仅 Linux 等支持的平台）
+- --pyav                fast 探测改用 PyAV 在进程内打开容器（需已安装 PyAV）。不受 --timeout 约束、libav 崩溃会终止整个扫描，
+                        且只要能打开即判通过，比 ffprobe（有任何错误输出即失败）宽松
 
-仅打印报告到标准输出；**不会**在目标目录写任何文件。
+仅打印报告到标准输出；**不会**在目标目录写任何文件（结果缓存位于用户缓存目录，可用 --no-cache 关闭）。
 """
 
 from __future__ import annotations
 import argparse
+import array
 import concurrent.futures as futures
+import functools
 import os
 import sys
 import time
 import subprocess
-import locale
+import shutil
+import signal
+import sqlite3
+import queue
+import threading
 from pathlib import Path
 from dataclasses import dataclass
-from typing import List, Tuple, Dict, Optional
+from typing import Callable, List, Tuple, Dict, FrozenSet, Iterator, NamedTuple, Optional
 
 # ----------------------------- 工具可用性检查 -----------------------------
 
-def cmd_exists(cmd: str) -> bool:
-    try:
-        subprocess.run([cmd, '-version'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        return True
-    except Exception:
-        return False
+def resolve_tool(cmd: str) -> Tuple[str, bool]:
+    """在 PATH 中查找工具，返回 (用于调用的路径, 是否可用)；找不到时仍返回原命令名。"""
+    found = shutil.which(cmd)
+    return found or cmd, found is not None
 
-HAS_FFPROBE = cmd_exists('ffprobe')
-HAS_FFMPEG  = cmd_exists('ffmpeg')
+# 仅在 PATH 中查找，不启动子进程（连 --help 也不必等待三次工具启动）；每个工具只查找一次，
+# 解析出的完整路径直接用于后续调用，省去每次启动时的 PATH 搜索
+FFPROBE_BIN, HAS_FFPROBE = resolve_tool('ffprobe')
+FFMPEG_BIN, HAS_FFMPEG = resolve_tool('ffmpeg')
+EXIFTOOL_BIN, HAS_EXIFTOOL = resolve_tool('exiftool')
 
-# exiftool 的版本参数是 -ver；若失败，不抛出异常，仅视为不可用
+# PyAV（libav 的 Python 绑定）为可选依赖：加 --pyav 时容器探测在进程内完成，
+# 不再为每个文件 fork/exec 一次 ffprobe 并重复初始化编解码器表
 try:
-    _ = subprocess.run(['exiftool', '-ver'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    HAS_EXIFTOOL = (_ and _.returncode == 0) or cmd_exists('exiftool')
-except Exception:
-    HAS_EXIFTOOL = False
+    import av
+    HAS_PYAV = True
+except ImportError:
+    av = None
+    HAS_PYAV = False
+
+# 是否以 PyAV 代替 ffprobe，由 main() 按 --pyav 设置。默认关闭：进程内打开无法超时中断（卡住的 NAS 会永久占住线程）、
+# libav 内部崩溃会带走整个扫描进程，且判定比 ffprobe 宽松（不看错误输出）
+USE_PYAV = False
 
 # ----------------------------- 文件类型 -----------------------------
 
-DEFAULT_IMAGE_EXTS = {
+DEFAULT_IMAGE_EXTS = frozenset({
     '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tif', '.tiff', '.webp',
     '.heic', '.heif', '.dng', '.cr2', '.cr3', '.nef', '.arw', '.raf', '.rw2', '.orf'
-}
+})
 
-DEFAULT_VIDEO_EXTS = {
+DEFAULT_VIDEO_EXTS = frozenset({
     '.mp4', '.m4v', '.mov', '.avi', '.mkv', '.webm', '.wmv', '.flv', '.mts', '.m2ts', '.ts',
     '.3gp', '.3gpp', '.mxf', '.mpg', '.mpeg', '.vob'
-}
+})
+
+# 本次扫描实际使用的扩展名集合（图片与视频走同一套检测流程，不再区分）：main() 按 --include-exts 构造一次，
+# 遍历线程与检测热路径直接读取
+MEDIA_EXTS: FrozenSet[str] = DEFAULT_IMAGE_EXTS | DEFAULT_VIDEO_EXTS
+
+# 文件头预检：只识别明显无效的头部（空文件、过短、全零）。不按魔数判定：魔数相符不代表容器完整（截断的 MP4 仍有 ftyp），
+# 魔数不符也常是合法写法（MPEG-TS 存为 .mp4、以 uuid 原子开头的 .mov、裸码流 .m4v 等）。
+HEADER_SIZE = 64
+HEADER_MIN_SIZE = 12     # 比任何可解码的图片/视频都短，头部不足该长度即视为截断
+HEADER_BATCH = 256       # 遍历线程每攒够这么多个文件，集中预读一次文件头
+HEADER_READ_DEPTH = 32   # 预读时同时在途的读请求数
 
 # ----------------------------- 数据结构 -----------------------------
 
+# 检测热路径不为每个文件构造对象：audit_one 返回轻量元组 AuditRow = (path, status, reason, duration_ms)，
+# status 为下列整数状态码，OK 文件的 reason 为 None。FileResult 仅在输出清单时按需构造。
+STATUS_OK, STATUS_DAMAGED, STATUS_ERROR, STATUS_SKIPPED = range(4)
+STATUS_NAMES = ('ok', 'damaged', 'error', 'skipped')
+
+AuditRow = Tuple[str, int, Optional[str], int]
+
+
 @dataclass
 class FileResult:
-    path: Path
+    path: str
     ok: bool
     status: str  # 'ok'|'damaged'|'error'|'skipped'
     reason: str
     mode: str
     duration_ms: int
 
+    @classmethod
+    def from_row(cls, path: str, status: int, reason: Optional[str], duration_ms: int, mode: str) -> 'FileResult':
+        ok = status in (STATUS_OK, STATUS_SKIPPED)
+        return cls(path, ok, STATUS_NAMES[status], reason or '', mode, duration_ms)
+
+
+class DamagedTable:
+    """按列（Struct-of-Arrays）保存损坏/错误文件：状态码与耗时存入紧凑的 array，避免逐文件对象开销。"""
+
+    def __init__(self):
+        self.paths: List[str] = []
+        self.statuses = array.array('B')
+        self.reasons: List[Optional[str]] = []
+        self.durations = array.array('I')
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def append(self, row: AuditRow) -> None:
+        path, status, reason, duration_ms = row
+        self.paths.append(path)
+        self.statuses.append(status)
+        self.reasons.append(reason)
+        self.durations.append(duration_ms)
+
+    def results(self, mode: str) -> Iterator[FileResult]:
+        for i in range(len(self.paths)):
+            yield FileResult.from_row(self.paths[i], self.statuses[i], self.reasons[i], self.durations[i], mode)
+
 # ----------------------------- 子进程运行 -----------------------------
 
-def run(cmd: List[str], timeout: int) -> Tuple[int, str, str]:
-    """运行子进程，返回 (returncode, stdout, stderr)。
-    Windows 下避免因控制台本地编码（如 GBK）与工具输出（常为 UTF-8）不一致而解码失败。
-    统一以二进制捕获，再按 UTF-8 → 系统首选编码 → GBK/CP936 → Latin-1 顺序回退解码。
+# Windows 下为控制台程序创建子进程默认会分配/闪现控制台窗口，开销可观且干扰多线程；
+# 统一以隐藏窗口、不分配控制台的方式启动。其他平台无需额外参数。
+if sys.platform == 'win32':
+    _startupinfo = subprocess.STARTUPINFO()
+    _startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    _startupinfo.wShowWindow = subprocess.SW_HIDE
+    POPEN_KWARGS: Dict[str, object] = {
+        'creationflags': subprocess.CREATE_NO_WINDOW,
+        'startupinfo': _startupinfo,
+    }
+else:
+    POPEN_KWARGS = {}
+
+# ----------------------------- 子进程资源上限 -----------------------------
+# 由内核对每个外部工具进程强制 CPU 时间（及可选的地址空间/内存）上限。CPU 上限取 timeout × CPU 核数，
+# 即墙钟超时内进程最多可能消耗的 CPU 时间：ffmpeg 除解码线程外还有音频解码、解复用与滤镜线程，按 -threads 估算会让
+# 正常的多核解码先于墙钟超时被 SIGXCPU 杀掉而误判损坏。它不会先于墙钟超时触发，只在本程序被强制结束、
+# 子进程成为孤儿而无人执行墙钟超时时，由内核兜底终止失控的解码。
+# Linux 在进程启动后用 prlimit 设置（不用 preexec_fn：多线程下 fork 后执行 Python 代码不安全）；
+# Windows 用作业对象（Job Object）；其他平台不设内核上限。墙钟超时始终保留，兜底卡在 IO 上、不耗 CPU 的进程。
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+HAS_PRLIMIT = resource is not None and hasattr(resource, 'prlimit')
+
+# 超出 RLIMIT_CPU 软上限的进程被 SIGXCPU 终止，Popen 返回码为负的信号值
+_SIGXCPU_RC = -signal.SIGXCPU if hasattr(signal, 'SIGXCPU') else None
+
+_CPU_COUNT = os.cpu_count() or 1
+
+# 单个外部工具进程的内存上限（字节）；0 表示不限制，由 main() 按 --mem-limit 设置
+MEM_LIMIT_BYTES = 0
+
+if sys.platform == 'win32':
+    import ctypes
+    from ctypes import wintypes
+
+    class _JOBOBJECT_BASIC_LIMIT_INFORMATION(ctypes.Structure):
+        _fields_ = [
+            ('PerProcessUserTimeLimit', ctypes.c_int64),
+            ('PerJobUserTimeLimit', ctypes.c_int64),
+            ('LimitFlags', wintypes.DWORD),
+            ('MinimumWorkingSetSize', ctypes.c_size_t),
+            ('MaximumWorkingSetSize', ctypes.c_size_t),
+            ('ActiveProcessLimit', wintypes.DWORD),
+            ('Affinity', ctypes.c_size_t),
+            ('PriorityClass', wintypes.DWORD),
+            ('SchedulingClass', wintypes.DWORD),
+        ]
+
+    class _IO_COUNTERS(ctypes.Structure):
+        _fields_ = [(name, ctypes.c_uint64) for name in (
+            'ReadOperationCount', 'WriteOperationCount', 'OtherOperationCount',
+            'ReadTransferCount', 'WriteTransferCount', 'OtherTransferCount',
+        )]
+
+    class _JOBOBJECT_EXTENDED_LIMIT_INFORMATION(ctypes.Structure):
+        _fields_ = [
+            ('BasicLimitInformation', _JOBOBJECT_BASIC_LIMIT_INFORMATION),
+            ('IoInfo', _IO_COUNTERS),
+            ('ProcessMemoryLimit', ctypes.c_size_t),
+            ('JobMemoryLimit', ctypes.c_size_t),
+            ('PeakProcessMemoryUsed', ctypes.c_size_t),
+            ('PeakJobMemoryUsed', ctypes.c_size_t),
+        ]
+
+    _JOB_OBJECT_LIMIT_PROCESS_TIME = 0x00000002
+    _JOB_OBJECT_LIMIT_PROCESS_MEMORY = 0x00000100
+    _JobObjectExtendedLimitInformation = 9
+
+    _kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+    _kernel32.CreateJobObjectW.restype = wintypes.HANDLE
+    _kernel32.CreateJobObjectW.argtypes = (ctypes.c_void_p, wintypes.LPCWSTR)
+    _kernel32.SetInformationJobObject.restype = wintypes.BOOL
+    _kernel32.SetInformationJobObject.argtypes = (wintypes.HANDLE, ctypes.c_int, ctypes.c_void_p, wintypes.DWORD)
+    _kernel32.AssignProcessToJobObject.restype = wintypes.BOOL
+    _kernel32.AssignProcessToJobObject.argtypes = (wintypes.HANDLE, wintypes.HANDLE)
+    _kernel32.CloseHandle.argtypes = (wintypes.HANDLE,)
+
+
+def limit_child(proc: subprocess.Popen, cpu_seconds: int) -> Optional[object]:
+    """为刚启动的子进程设置内核级资源上限；返回需在进程结束后释放的句柄（仅 Windows），失败时静默放弃。"""
+    if HAS_PRLIMIT:
+        try:
+            resource.prlimit(proc.pid, resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 5))
+            if MEM_LIMIT_BYTES:
+                resource.prlimit(proc.pid, resource.RLIMIT_AS, (MEM_LIMIT_BYTES, MEM_LIMIT_BYTES))
+        except (OSError, ValueError):
+            pass
+        return None
+    if sys.platform == 'win32':
+        job = _kernel32.CreateJobObjectW(None, None)
+        if not job:
+            return None
+        info = _JOBOBJECT_EXTENDED_LIMIT_INFORMATION()
+        info.BasicLimitInformation.LimitFlags = _JOB_OBJECT_LIMIT_PROCESS_TIME
+        info.BasicLimitInformation.PerProcessUserTimeLimit = cpu_seconds * 10_000_000  # 单位 100ns
+        if MEM_LIMIT_BYTES:
+            info.BasicLimitInformation.LimitFlags |= _JOB_OBJECT_LIMIT_PROCESS_MEMORY
+            info.ProcessMemoryLimit = MEM_LIMIT_BYTES
+        ok = _kernel32.SetInformationJobObject(job, _JobObjectExtendedLimitInformation,
+                                               ctypes.byref(info), ctypes.sizeof(info))
+        if ok:
+            ok = _kernel32.AssignProcessToJobObject(job, int(proc._handle))
+        if not ok:
+            _kernel32.CloseHandle(job)
+            return None
+        return job
+    return None
+
+
+def release_limit(handle: Optional[object]) -> None:
+    if handle is not None:
+        _kernel32.CloseHandle(handle)
+
+def run_bytes(cmd: List[str], timeout: int) -> Tuple[int, bytes, bytes]:
+    """运行子进程，返回未解码的 (returncode, stdout, stderr)。
+    检测逻辑只关心 stderr 是否为空及是否含特定标记，按字节判断即可，从不解码工具输出，
+    也就不受 Windows 控制台本地编码（如 GBK）与工具输出（常为 UTF-8）不一致的影响。
+    CPU 时间上限为 timeout × CPU 核数（见上）；超限被内核终止时同样返回 124。
     """
     try:
-        p = subprocess.run(
+        with subprocess.Popen(
             cmd,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
-            timeout=timeout,
-            check=False,
-            text=False,              # 以字节读取，避免在 reader 线程中用本地编码解码
-            stdin=subprocess.DEVNULL # 不从标准输入读取，防止阻塞
+            stdin=subprocess.DEVNULL, # 不从标准输入读取，防止阻塞
+            **POPEN_KWARGS            # 不传 text/encoding：以字节读取，避免在 reader 线程中用本地编码解码
+        ) as p:
+            handle = limit_child(p, timeout * _CPU_COUNT)
+            try:
+                out, err = p.communicate(timeout=timeout)
+            except subprocess.TimeoutExpired as e:
+                p.kill()
+                # 与 subprocess.run 一致：POSIX 下只等待子进程退出，不再读管道——包装脚本派生的孙进程
+                # 可能仍持有管道写端，communicate() 会一直等到它们全部退出；Windows 的读线程需 communicate() 收尾
+                if sys.platform == 'win32':
+                    p.communicate()
+                else:
+                    p.wait()
+                return 124, b"", f"Timeout: {e}".encode('utf-8')
+            finally:
+                release_limit(handle)
+        if _SIGXCPU_RC is not None and p.returncode == _SIGXCPU_RC:
+            return 124, out or b"", b"Timeout: CPU time limit exceeded"
+        return p.returncode, out or b"", err or b""
+    except Exception as e:
+        return 125, b"", f"Exception: {e!r}".encode('utf-8')
+# ----------------------------- exiftool 常驻进程 -----------------------------
+
+class ExifToolDaemon:
+    """以 `-stay_open True -@ -` 模式常驻的 exiftool 进程。
+
+    exiftool 的 Perl 解释器启动开销远大于单个文件的元数据解析，常驻后每个文件只需
+    经 stdin 写入一组参数并以 -execute 结束。exiftool 处理完毕会在 stdout 输出 `{ready}`，
+    并借 `-echo4 {ready}` 在 stderr 输出同样的哨兵，据此分别切分两路输出。
+    每个实例只供一个线程使用（见 exiftool_probe），不做内部加锁。
+    """
+
+    SENTINEL = b'{ready}'
+
+    def __init__(self):
+        self.proc = subprocess.Popen(
+            [EXIFTOOL_BIN, '-stay_open', 'True', '-@', '-', '-common_args', '-charset', 'filename=utf8'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            **POPEN_KWARGS
         )
-        stdout_b = p.stdout or b""
-        stderr_b = p.stderr or b""
+        # 两路输出各由一个后台线程按行搬运到队列，便于带超时读取且避免管道写满互锁
+        self._out_q: queue.Queue = queue.Queue()
+        self._err_q: queue.Queue = queue.Queue()
+        for stream, q in ((self.proc.stdout, self._out_q), (self.proc.stderr, self._err_q)):
+            threading.Thread(target=self._pump, args=(stream, q), daemon=True).start()
 
-        def _decode(buf: bytes) -> str:
-            for enc in ("utf-8", locale.getpreferredencoding(False) or "utf-8", "gbk", "cp936", "latin-1"):
-                try:
-                    return buf.decode(enc)
-                except Exception:
-                    pass
-            return buf.decode("utf-8", errors="replace")
+    @staticmethod
+    def _pump(stream, q: queue.Queue) -> None:
+        for line in iter(stream.readline, b''):
+            q.put(line)
+        q.put(None)  # EOF：进程已退出
+
+    def alive(self) -> bool:
+        return self.proc.poll() is None
+
+    def _collect(self, q: queue.Queue, deadline: float) -> bytes:
+        chunks = []
+        while True:
+            line = q.get(timeout=max(0.0, deadline - time.monotonic()))
+            if line is None:
+                raise EOFError('exiftool exited')
+            if line.rstrip(b'\r\n') == self.SENTINEL:
+                return b''.join(chunks)
+            chunks.append(line)
+
+    def probe(self, path: str, timeout: int) -> Tuple[int, bytes, bytes]:
+        """与 run_bytes() 相同的返回约定：(returncode, stdout, stderr)；常驻模式下没有逐文件退出码，成功恒为 0。"""
+        argv = ['-fast', '-fast2', '-n', '-S', '-s', '-s', '-s', path, '-echo4', '{ready}', '-execute']
+        try:
+            self.proc.stdin.write(('\n'.join(argv) + '\n').encode('utf-8'))
+            self.proc.stdin.flush()
+            deadline = time.monotonic() + timeout
+            out_b = self._collect(self._out_q, deadline)
+            err_b = self._collect(self._err_q, deadline)
+        except queue.Empty:
+            self.kill()
+            return 124, b"", f"Timeout: exiftool daemon exceeded {timeout}s".encode('utf-8')
+        except Exception as e:
+            self.kill()
+            return 125, b"", f"Exception: {e!r}".encode('utf-8')
+        return 0, out_b, err_b
+
+    def close(self) -> None:
+        if not self.alive():
+            return
+        try:
+            self.proc.stdin.write(b'-stay_open\nFalse\n')
+            self.proc.stdin.flush()
+            self.proc.wait(timeout=5)
+        except Exception:
+            self.kill()
+
+    def kill(self) -> None:
+        try:
+            self.proc.kill()
+            self.proc.wait(timeout=5)
+        except Exception:
+            pass
+
+
+_EXIF_LOCAL = threading.local()
+_EXIF_DAEMONS: List[ExifToolDaemon] = []
+_EXIF_DAEMONS_LOCK = threading.Lock()
+
+
+def _daemon_arg_ok(path: str) -> bool:
+    """参数文件按行分隔且按 UTF-8 读取：含换行符的路径，或无法编码为 UTF-8 的路径
+    （Linux 下非 UTF-8 文件名经 surrogateescape 解码而来）无法经 stdin 传递。"""
+    if '\n' in path:
+        return False
+    try:
+        path.encode('utf-8')
+    except UnicodeEncodeError:
+        return False
+    return True
 
-        return p.returncode, _decode(stdout_b), _decode(stderr_b)
-    except subprocess.TimeoutExpired as e:
-        return 124, "", f"Timeout: {e}"
-    except Exception as e:
-        return 125, "", f"Exception: {e!r}"
+
+def _forget_daemon(daemon: ExifToolDaemon) -> None:
+    with _EXIF_DAEMONS_LOCK:
+        try:
+            _EXIF_DAEMONS.remove(daemon)
+        except ValueError:
+            pass
+
+
+def exiftool_probe(path: str, timeout: int) -> Tuple[int, bytes, bytes]:
+    """每个工作线程各持有一个常驻 exiftool；常驻进程无法启动或路径无法经 stdin 传递时回退为一次性调用
+    （一次性调用的参数由 subprocess 按文件系统编码传递，任意文件名均可）。
+    新启动的常驻进程在首个文件上即退出（不支持 -stay_open 的包装脚本或构建），本线程此后同样改用一次性调用。"""
+    daemon = getattr(_EXIF_LOCAL, 'daemon', None)
+    if not getattr(_EXIF_LOCAL, 'failed', False) and _daemon_arg_ok(path):
+        fresh = False
+        if daemon is None or not daemon.alive():
+            if daemon is not None:
+                _forget_daemon(daemon)  # 已退出（如超时被杀）的旧进程不再保留
+            try:
+                daemon = ExifToolDaemon()
+            except Exception:
+                _EXIF_LOCAL.failed = True
+                daemon = None
+            else:
+                fresh = True
+                with _EXIF_DAEMONS_LOCK:
+                    _EXIF_DAEMONS.append(daemon)
+            _EXIF_LOCAL.daemon = daemon
+        if daemon is not None:
+            result = daemon.probe(path, timeout)
+            if not (fresh and result[0] == 125 and not daemon.alive()):
+                return result
+            _forget_daemon(daemon)
+            _EXIF_LOCAL.daemon = None
+            _EXIF_LOCAL.failed = True
+    return run_bytes([EXIFTOOL_BIN, '-fast', '-fast2', '-n', '-S', '-s', '-s', '-s', path], timeout)
+
+
+def shutdown_exiftool_daemons() -> None:
+    with _EXIF_DAEMONS_LOCK:
+        daemons = list(_EXIF_DAEMONS)
+        _EXIF_DAEMONS.clear()
+    for daemon in daemons:
+        daemon.close()
 
 # ----------------------------- 检测核心 -----------------------------
 
@@ -130,32 +467,105 @@ FAST_BASIS = (
     "fast：仅进行容器/元数据探测（ffprobe + exiftool），不解码像素；速度快，可能漏检深层损坏。"
 )
 MEDIUM_BASIS = (
-    "medium：在 fast 基础上，额外用 ffmpeg 解码**首帧**（图像/视频），能发现大多数解码层错误。"
+    "medium：用 ffmpeg 一次调用完成容器解析与**首帧**解码（图像/视频），能发现大多数解码层错误。"
+)
+
+# ffmpeg 打开/解复用阶段的典型报错片段：命中即归为容器层失败，否则归为解码层失败
+DEMUX_ERROR_TOKENS = (
+    b'Invalid data found when processing input',
+    b'Error opening input',
+    b'moov atom not found',
+    b'EBML header parsing failed',
+    b'error reading header',
+    b'ould not find codec parameters',
+    b'No such file or directory',
+    b'Permission denied',
 )
 SLOW_BASIS = (
     "slow：对视频执行**全轨道完整解码**（所有帧/音频样本）到空设备，最严格但最慢；图像等效于 medium（单帧即完整）。"
 )
+MODE_BASIS = {'fast': FAST_BASIS, 'medium': MEDIUM_BASIS, 'slow': SLOW_BASIS}
 
 
-def is_image(path: Path, image_exts: set) -> bool:
-    return path.suffix.lower() in image_exts
+def read_header(path: str, size: int = HEADER_SIZE) -> bytes:
+    fd = os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+    try:
+        return os.read(fd, size)
+    finally:
+        os.close(fd)
 
 
-def is_video(path: Path, video_exts: set) -> bool:
-    return path.suffix.lower() in video_exts
+def evict_page_cache(path: str) -> None:
+    """通知内核丢弃该文件的页缓存（POSIX_FADV_DONTNEED），避免全盘解码挤掉宿主机的热数据。
+    仅是建议性提示，不移动数据；不支持 posix_fadvise 的平台（Windows/macOS）静默忽略。
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def read_headers(paths: List[str], pool: futures.Executor) -> List[Optional[bytes]]:
+    """并发读取一批文件头，读取失败的位置为 None。
+    冷缓存 HDD 上大量 64 字节随机读是瓶颈：让多个请求同时在途，由内核 IO 调度合并寻道。
+    """
+    def _read(path: str) -> Optional[bytes]:
+        try:
+            return read_header(path)
+        except OSError:
+            return None
+    return list(pool.map(_read, paths))
+
+
+def header_is_bogus(path: str, header: Optional[bytes] = None) -> bool:
+    """文件头明显无效（空文件、短于 HEADER_MIN_SIZE、全零）时返回 True，可直接判损坏，代价仅为一次小块读取。
+    读取失败时返回 False，交由后续检测给出结论。
+    """
+    if header is None:
+        try:
+            header = read_header(path)
+        except OSError:
+            return False
+    return len(header) < HEADER_MIN_SIZE or not header.strip(b'\x00')
 
 
-def check_fast(path: Path, timeout: int) -> Tuple[bool, str]:
+def probe_container_inproc(path: str) -> Tuple[bool, str]:
+    """用 PyAV 在进程内打开容器并读取流信息，作用接近 ffprobe 的 format/stream 探测。
+    与 ffprobe 不同：没有超时、不经子进程隔离，且只在打开失败时判失败（libav 的警告/错误日志不计入）。
+    """
+    try:
+        with av.open(path, mode='r') as container:
+            n_streams = len(container.streams)
+        return n_streams > 0, f"pyav streams={n_streams}"
+    except Exception as e:
+        return False, f"pyav error={type(e).__name__}"
+
+
+def check_fast(path: str, timeout: int) -> Tuple[bool, str]:
     """仅探测容器/元数据是否可被解析。任一工具成功且无错误即判定通过。"""
     diagnostics = []
     ok_flags = []
 
-    if HAS_FFPROBE:
+    if USE_PYAV:
+        pyav_ok, why = probe_container_inproc(path)
+        ok_flags.append(pyav_ok)
+        diagnostics.append(why)
+    elif HAS_FFPROBE:
         # -v error：仅输出错误；-show_entries/-show_format 可尽量覆盖图片/视频
-        rc, out, err = run([
-            'ffprobe', '-v', 'error',
+        # ffprobe 只接受一个输入（第二个 -i 直接报错），concat 解复用器又会把多个文件合成一个上下文、
+        # 丢失逐文件结论，因此无法多文件共用一次 ffprobe；需要省去进程启动可用 --pyav（见上）。
+        rc, out, err = run_bytes([
+            FFPROBE_BIN, '-v', 'error',
             '-show_entries', 'format=format_name:stream=codec_name,codec_type',
-            '-of', 'json', str(path)
+            '-of', 'json', path
         ], timeout)
         ffprobe_ok = (rc == 0 and (not err.strip()))
         ok_flags.append(ffprobe_ok)
@@ -165,10 +575,10 @@ def check_fast(path: Path, timeout: int) -> Tuple[bool, str]:
 
     if HAS_EXIFTOOL:
         # 纯读取元数据（-fast -fast2 加速）；出现 Error:* 视为失败
-        rc2, out2, err2 = run(['exiftool', '-fast', '-fast2', '-n', '-S', '-s', '-s', '-s', str(path)], timeout)
-        exif_ok = (rc2 == 0 and (('Error' not in out2) and (not err2.strip())))
+        rc2, out2, err2 = exiftool_probe(path, timeout)
+        exif_ok = (rc2 == 0 and ((b'Error' not in out2) and (not err2.strip())))
         ok_flags.append(exif_ok)
-        diagnostics.append(f"exiftool rc={rc2} has_error_token={'Error' in out2}")
+        diagnostics.append(f"exiftool rc={rc2} has_error_token={b'Error' in out2}")
     else:
         diagnostics.append("exiftool unavailable")
 
@@ -178,86 +588,508 @@ def check_fast(path: Path, timeout: int) -> Tuple[bool, str]:
     return ok, reason
 
 
-def check_decode_first_frame(path: Path, timeout: int) -> Tuple[bool, str]:
+def check_decode_first_frame(path: str, timeout: int) -> Tuple[bool, str]:
     """解码首帧到空设备；图像和视频都适用。"""
     if not HAS_FFMPEG:
         return False, 'ffmpeg unavailable'
 
     # -v error：仅显示错误；-frames:v 1 解码一帧；-an 关闭音频；-f null - 输出到空
-    rc, out, err = run([
-        'ffmpeg', '-v', 'error', '-hide_banner', '-nostdin',
-        '-i', str(path), '-frames:v', '1', '-an', '-f', 'null', '-'
+    rc, out, err = run_bytes([
+        FFMPEG_BIN, '-v', 'error', '-hide_banner', '-nostdin',
+        '-i', path, '-frames:v', '1', '-an', '-f', 'null', '-'
     ], timeout)
     ok = (rc == 0 and (not err.strip()))
     return ok, f"ffmpeg[first-frame] rc={rc} err_len={len(err.strip())}"
 
 
-def check_full_decode(path: Path, timeout: int) -> Tuple[bool, str]:
-    """完整解码所有轨道（视频/音频）到空设备；图像相当于解码一帧。"""
+def check_medium_fused(path: str, timeout: int) -> Tuple[bool, str, bool, str]:
+    """单次 ffmpeg 调用同时完成容器解析与首帧解码，代替 check_fast + check_decode_first_frame。
+    返回 (ok_fast, why_fast, ok_first, why_first)：按 stderr 中的报错片段区分解复用层与解码层问题。
+    """
+    if not HAS_FFMPEG:
+        return False, 'ffmpeg unavailable', False, 'ffmpeg unavailable'
+
+    # -xerror：遇到首个错误即退出，损坏文件不必继续解码
+    rc, out, err = run_bytes([
+        FFMPEG_BIN, '-v', 'error', '-hide_banner', '-nostdin', '-xerror',
+        '-i', path, '-frames:v', '1', '-an', '-f', 'null', '-'
+    ], timeout)
+    err = err.strip()
+    # 超时/启动异常时无法确认容器可读，一并视为容器层失败
+    demux_failed = rc in (124, 125) or any(tok in err for tok in DEMUX_ERROR_TOKENS)
+    ok_first = (rc == 0 and (not err))
+    why_fast = f"ffmpeg[demux] {'failed' if demux_failed else 'ok'}"
+    why_first = f"ffmpeg[first-frame] rc={rc} err_len={len(err)}"
+    return (not demux_failed), why_fast, ok_first, why_first
+
+
+def check_full_decode(path: str, timeout: int, threads: int = 0) -> Tuple[bool, str]:
+    """完整解码所有轨道（视频/音频）到空设备；图像相当于解码一帧。
+    threads 传给 ffmpeg 的 -threads（0 表示由 ffmpeg 自动决定）。
+    """
     if not HAS_FFMPEG:
         return False, 'ffmpeg unavailable'
 
-    rc, out, err = run([
-        'ffmpeg', '-v', 'error', '-hide_banner', '-nostdin',
-        '-i', str(path), '-map', '0', '-f', 'null', '-'
+    rc, out, err = run_bytes([
+        FFMPEG_BIN, '-v', 'error', '-hide_banner', '-nostdin',
+        '-threads', str(threads),
+        '-i', path, '-map', '0', '-f', 'null', '-'
     ], timeout)
     ok = (rc == 0 and (not err.strip()))
     return ok, f"ffmpeg[full-decode] rc={rc} err_len={len(err.strip())}"
 
 
-def audit_one(path: Path, mode: str, timeout: int, image_exts: set, video_exts: set) -> FileResult:
-    t0 = time.time()
+def _elapsed_ms(t0: float) -> int:
+    # t0 取自 time.monotonic()：墙钟可能回拨（NTP 校时、虚拟机恢复），耗时不能为负（DamagedTable 以无符号数组保存）
+    return int((time.monotonic()-t0)*1000)
+
+
+def _verdict(path: str, ok: bool, reason: str, t0: float) -> AuditRow:
+    # 绝大多数文件正常：OK 行不保留原因文本
+    if ok:
+        return path, STATUS_OK, None, _elapsed_ms(t0)
+    return path, STATUS_DAMAGED, reason, _elapsed_ms(t0)
+
+
+def audit_one(path: str, ext: str, mode: str, timeout: int,
+              strict_metadata: bool = False, ffmpeg_threads: int = 0,
+              evict_cache: bool = False, header: Optional[bytes] = None) -> AuditRow:
+    """ext 为遍历时已解析好的小写扩展名，这里不再从路径重复解析；header 为预读的文件头（可无）。"""
+    t0 = time.monotonic()
     try:
-        if not (is_image(path, image_exts) or is_video(path, video_exts)):
+        if ext not in MEDIA_EXTS:
             # 非支持扩展名：跳过
-            return FileResult(path, True, 'skipped', 'unsupported extension', mode, int((time.time()-t0)*1000))
+            return path, STATUS_SKIPPED, None, _elapsed_ms(t0)
 
-        # — fast：容器/元数据探测
-        ok_fast, why_fast = check_fast(path, timeout)
-        if mode == 'fast':
-            status = 'ok' if ok_fast else 'damaged'
-            reason = f"{FAST_BASIS} | diag: {why_fast}"
-            return FileResult(path, ok_fast, status, reason, mode, int((time.time()-t0)*1000))
+        # — 文件头预检：头部明显无效（空/过短/全零）时直接判损坏，不再启动外部工具；其余文件照常检测
+        if header_is_bogus(path, header):
+            return _verdict(path, False, f"{MODE_BASIS[mode]} | header: empty, truncated or all zero", t0)
+
+        if mode != 'fast' and not strict_metadata:
+            # — medium/slow：ffmpeg 首帧解码已覆盖容器解析，一次调用代替 ffprobe + exiftool + ffmpeg
+            ok_fast, why_fast, ok_first, why_first = check_medium_fused(path, timeout)
+        else:
+            # — fast：容器/元数据探测
+            ok_fast, why_fast = check_fast(path, timeout)
+            if mode == 'fast':
+                return _verdict(path, ok_fast, f"{FAST_BASIS} | diag: {why_fast}", t0)
+
+            # — medium：在 fast 成功的基础上尝试首帧解码；若 fast 已失败仍继续尝试解码，以提高召回
+            ok_first, why_first = check_decode_first_frame(path, timeout)
 
-        # — medium：在 fast 成功的基础上尝试首帧解码；若 fast 已失败仍继续尝试解码，以提高召回
-        ok_first, why_first = check_decode_first_frame(path, timeout)
         if mode == 'medium':
             ok = ok_fast and ok_first  # 两者都过更稳妥；允许根据需要调整为 ok_fast or ok_first
             # 解释：medium 要求容器解析+首帧解码均无报错
-            status = 'ok' if ok else 'damaged'
-            reason = f"{MEDIUM_BASIS} | fast: {why_fast} | first-frame: {why_first}"
-            return FileResult(path, ok, status, reason, mode, int((time.time()-t0)*1000))
+            return _verdict(path, ok, f"{MEDIUM_BASIS} | fast: {why_fast} | first-frame: {why_first}", t0)
 
         # — slow：完整解码（最严格）；为了更可解释，同时给出 fast 与 first-frame 的诊断
-        ok_full, why_full = check_full_decode(path, timeout)
+        ok_full, why_full = check_full_decode(path, timeout, ffmpeg_threads)
         # 慎重起见，slow 模式以完整解码为准
         ok = ok_full
-        status = 'ok' if ok else 'damaged'
         reason = f"{SLOW_BASIS} | fast: {why_fast} | first-frame: {why_first} | full: {why_full}"
-        return FileResult(path, ok, status, reason, mode, int((time.time()-t0)*1000))
+        return _verdict(path, ok, reason, t0)
 
     except Exception as e:
-        return FileResult(path, False, 'error', f'Exception: {e!r}', mode, int((time.time()-t0)*1000))
+        return path, STATUS_ERROR, f'Exception: {e!r}', _elapsed_ms(t0)
+    finally:
+        if evict_cache:
+            # 外部工具均已退出，本文件不会再被读取：释放其占用的页缓存
+            evict_page_cache(path)
+
+# ----------------------------- 结果缓存 -----------------------------
+
+DEFAULT_CACHE_DB = os.path.join(os.path.expanduser('~'), '.cache', 'check_media_integrity.sqlite3')
+
+Stamp = Tuple[int, int]  # (st_size, st_mtime_ns)
+
+
+def cache_profile(mode: str, strict_metadata: bool, use_pyav: bool) -> str:
+    """影响判定的检测参数组合，与路径一起作为缓存键：不同组合下的 OK 结论互不通用，也互不覆盖。"""
+    strict = strict_metadata and mode != 'fast'  # fast 本就执行完整的容器/元数据探测
+    profile = mode + ('+strict' if strict else '')
+    if use_pyav and (mode == 'fast' or strict):
+        profile += '+pyav'  # 只有执行 check_fast 时才用到 PyAV
+    return profile
+
+
+class ResultCache:
+    """跨次运行的检测结果缓存（SQLite），以 (path, size, mtime_ns) 判断文件是否变化。
+
+    相同检测参数（profile，见 cache_profile）下上次判定 OK 且未变化的文件直接跳过，无需启动任何外部工具。
+    查询由调用线程各自的连接完成；写入经队列交给后台线程，按批 executemany 并提交，
+    避免逐文件提交带来的 fsync 拖慢检测。路径按 os.fsencode 存为 BLOB：Linux 下非 UTF-8 文件名
+    （surrogateescape 解码而来）无法作为 TEXT 交给 sqlite3。写入失败（如另一个扫描正持有写锁）时记入 error 并停止写入，
+    不再排队，检测照常进行。
+    """
+
+    WRITE_BATCH = 500
+    APPLICATION_ID = 0x434D4931  # 'CMI1'：写入 PRAGMA application_id，标记本工具创建的数据库
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        parent = os.path.dirname(db_path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        conn = sqlite3.connect(db_path)
+        try:
+            # --cache-db 可能误指向其他程序的数据库：不是本工具创建的非空数据库一律拒绝使用，不做任何修改
+            if conn.execute('PRAGMA application_id').fetchone()[0] != self.APPLICATION_ID:
+                if conn.execute('SELECT 1 FROM sqlite_master LIMIT 1').fetchone() is not None:
+                    raise sqlite3.DatabaseError(f'{db_path} 不是本工具创建的结果缓存')
+                conn.execute(f'PRAGMA application_id = {self.APPLICATION_ID}')
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS results ('
+                'path BLOB, profile TEXT, size INT, mtime_ns INT, status TEXT, reason TEXT, '
+                'PRIMARY KEY (path, profile))'
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        self.error: Optional[Exception] = None
+        self._local = threading.local()
+        self._writes: queue.Queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def is_fresh_ok(self, path: str, stamp: Stamp, profile: str) -> bool:
+        try:
+            conn = getattr(self._local, 'conn', None)
+            if conn is None:
+                conn = self._local.conn = self._connect()
+            row = conn.execute('SELECT size, mtime_ns, status FROM results WHERE path = ? AND profile = ?',
+                               (os.fsencode(path), profile)).fetchone()
+        except (sqlite3.Error, ValueError):
+            return False  # 查询失败时按未命中处理，照常检测
+        return row is not None and (row[0], row[1]) == stamp and row[2] == 'ok'
+
+    def close_reader(self) -> None:
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def record(self, path: str, stamp: Stamp, profile: str, status: int, reason: Optional[str]) -> None:
+        if self.error is not None:
+            return  # 写入线程已退出：不再排队，避免队列无限增长
+        self._writes.put((os.fsencode(path), profile, stamp[0], stamp[1], STATUS_NAMES[status], reason))
+
+    def _write_loop(self) -> None:
+        try:
+            conn = self._connect()
+        except sqlite3.Error as e:
+            self.error = e
+            return
+        try:
+            stop = False
+            while not stop:
+                rows = [self._writes.get()]
+                # 取走已排队的所有写入（上限 WRITE_BATCH），合并为一次事务
+                while len(rows) < self.WRITE_BATCH:
+                    try:
+                        rows.append(self._writes.get_nowait())
+                    except queue.Empty:
+                        break
+                if None in rows:
+                    stop = True
+                    rows = [r for r in rows if r is not None]
+                if rows:
+                    conn.executemany('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)', rows)
+                    conn.commit()
+        except (sqlite3.Error, ValueError) as e:
+            self.error = e
+        finally:
+            conn.close()
+
+    def close(self) -> None:
+        """写完队列中剩余的结果后关闭。"""
+        self._writes.put(None)
+        self._writer.join()
 
 # ----------------------------- 扫描与进度 -----------------------------
 
-def iter_files(root: Path) -> List[Path]:
-    files: List[Path] = []
-    for dirpath, dirnames, filenames in os.walk(root):
-        # 不修改任何属性，仅列举
-        for fn in filenames:
+def iter_files(root: str, on_mount: Optional[Callable[[str, int], None]] = None) -> Iterator[Tuple[str, str]]:
+    """基于 os.scandir 遍历，产出 (路径字符串, 小写扩展名)。
+
+    直接使用 DirEntry 自带的名称与类型信息，不为每个文件构造 Path 对象，
+    扩展名也只在此处由文件名解析一次。目录的符号链接不跟随；指向文件的符号链接照常列出。
+    提供 on_mount 时不跨越挂载点：每个目录 stat 一次，设备号（st_dev）与 root 不同的目录
+    交给 on_mount(目录, 设备号) 另行遍历，本次遍历不再深入。
+    """
+    root_dev = None
+    stack = [root]
+    while stack:
+        dirpath = stack.pop()
+        try:
+            if on_mount is not None:
+                dev = os.stat(dirpath).st_dev
+                if root_dev is None:
+                    root_dev = dev
+                elif dev != root_dev:
+                    on_mount(dirpath, dev)
+                    continue
+            it = os.scandir(dirpath)
+        except OSError:
+            # 无权限/已被删除的目录：与 os.walk 默认行为一致，静默跳过
+            continue
+        with it:
+            for entry in it:
+                # 不修改任何属性，仅列举
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file():
+                        name = entry.name
+                        dot = name.rfind('.')
+                        yield entry.path, (name[dot:].lower() if dot > 0 else '')
+                except OSError:
+                    # 防御性处理异常文件名/条目
+                    pass
+
+
+class WorkItem(NamedTuple):
+    path: str
+    ext: str
+    header: Optional[bytes]  # 预读的文件头；读取失败时为 None
+    stamp: Optional[Stamp]   # (size, mtime_ns)，仅启用缓存时有值
+    dev: int                 # 所在设备号，用于按设备限制并发
+
+
+def is_rotational(dev: int) -> bool:
+    """判断设备是否为机械硬盘（Linux：/sys/dev/block/MAJ:MIN 的 queue/rotational）。
+    分区没有自己的 queue 目录，需回到所属整盘；网络/虚拟文件系统及其他平台无从判断，按非机械盘处理。
+    virtio/Xen 虚拟磁盘一律报告 rotational=1，实际后端多为 SSD 或网络存储，同样按非机械盘处理。
+    """
+    if not sys.platform.startswith('linux'):
+        return False
+    base = f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}"
+    real = os.path.realpath(base)
+    if '/virtio' in real or '/vbd-' in real:
+        return False
+    for candidate in (f"{base}/queue/rotational", f"{base}/../queue/rotational"):
+        try:
+            with open(candidate, 'r') as f:
+                return f.read().strip() == '1'
+        except OSError:
+            continue
+    return False
+
+
+class MountWalker:
+    """遍历一个挂载点（设备号相同的一棵子树）的后台线程，文件送入自己的有界队列。
+
+    各挂载点互不等待：一块慢盘遍历受阻或队列已满，只阻塞它自己的线程。
+    扩展名不符的文件计入 skipped，缓存命中的计入 cached，均不入队；
+    媒体文件按 HEADER_BATCH 个一批预读文件头，随路径一起以 WorkItem 入队。
+    预读同时在途的请求数为 HEADER_READ_DEPTH，机械硬盘则不超过其并发上限 limit。
+    """
+
+    def __init__(self, feeder: 'FileFeeder', root: str, dev: int, limit: Optional[int]):
+        self.root = root
+        self.dev = dev
+        self.limit = limit    # 该设备同时在检的文件数上限；None 表示不限
+        self.queue: queue.Queue = queue.Queue(maxsize=feeder.maxsize)
+        self.seen = 0         # 已入队的媒体文件数
+        self.skipped = 0      # 扩展名不符、未入队的文件数
+        self.cached = 0       # 缓存命中、未入队的媒体文件数
+        self.finished = False
+        self._feeder = feeder
+        self._thread = threading.Thread(target=self._walk, daemon=True)
+        self._thread.start()
+
+    def _stamp(self, path: str) -> Optional[Stamp]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    def _walk(self) -> None:
+        feeder = self._feeder
+        cache = feeder.cache
+        batch: List[Tuple[str, str, Optional[Stamp]]] = []
+        try:
+            with futures.ThreadPoolExecutor(max_workers=self.limit or HEADER_READ_DEPTH) as pool:
+                for p, ext in iter_files(self.root, feeder.add_mount):
+                    if ext in MEDIA_EXTS:
+                        stamp = None
+                        if cache is not None:
+                            try:
+                                stamp = self._stamp(p)
+                                if stamp is not None and cache.is_fresh_ok(p, stamp, feeder.profile):
+                                    self.cached += 1
+                                    continue
+                            except Exception:
+                                # 单个条目查缓存出错不能结束整个挂载点的遍历：不用缓存，照常检测
+                                stamp = None
+                        self.seen += 1
+                        batch.append((p, ext, stamp))
+                        if len(batch) >= HEADER_BATCH:
+                            self._flush(batch, pool)
+                            batch = []
+                    else:
+                        self.skipped += 1
+                self._flush(batch, pool)
+        finally:
+            if cache is not None:
+                cache.close_reader()
+            self.finished = True
+            feeder.arrived.set()
+
+    def describe(self) -> str:
+        dev = f"{os.major(self.dev)}:{os.minor(self.dev)}" if hasattr(os, 'major') else str(self.dev)
+        cap = f"机械硬盘，同时最多 {self.limit} 个文件" if self.limit else "不限（仅受 --workers 限制）"
+        return f"  {self.root}  [设备 {dev}] {cap}"
+
+    def _flush(self, batch: List[Tuple[str, str, Optional[Stamp]]], pool: futures.Executor) -> None:
+        headers = read_headers([p for p, _, _ in batch], pool)
+        for (p, ext, stamp), header in zip(batch, headers):
+            self.queue.put(WorkItem(p, ext, header, stamp, self.dev))
+            self._feeder.arrived.set()
+
+
+class FileFeeder:
+    """边遍历边把媒体文件送入有界队列，检测无需等待整棵目录树遍历完毕。
+
+    每个挂载点由各自的 MountWalker 线程遍历、送入各自的队列（遍历中遇到设备号变化的目录即另起一个），
+    队列容量有限，遍历领先检测过多时自动阻塞，内存占用与文件总数无关。
+    提供 cache 时先 stat 并查询缓存，命中（未变化且上次 OK）的文件不再入队；
+    stamp 为 (size, mtime_ns)，供检测完成后写回缓存，未启用缓存时为 None。
+    任一遍历线程入队或结束时置位 arrived，供主线程在无事可做时等待。
+    """
+
+    def __init__(self, root: str, maxsize: int,
+                 cache: Optional[ResultCache] = None, profile: str = '', hdd_parallelism: int = 0):
+        self.maxsize = maxsize
+        self.cache = cache
+        self.profile = profile
+        self.arrived = threading.Event()
+        self.walkers: List[MountWalker] = []
+        self._hdd_parallelism = hdd_parallelism
+        self._limits: Dict[int, Optional[int]] = {}
+        self._lock = threading.Lock()
+        try:
+            root_dev = os.stat(root).st_dev
+        except OSError:
+            root_dev = 0
+        self.add_mount(root, root_dev)
+
+    def device_limit(self, dev: int) -> Optional[int]:
+        """机械硬盘返回 hdd_parallelism，其他设备（或 hdd_parallelism 为 0）返回 None；按设备只判断一次。"""
+        if dev not in self._limits:
+            rotational = self._hdd_parallelism > 0 and is_rotational(dev)
+            self._limits[dev] = self._hdd_parallelism if rotational else None
+        return self._limits[dev]
+
+    def add_mount(self, root: str, dev: int) -> None:
+        # 新遍历线程在发现它的父线程结束之前登记，因此所有已登记线程都结束即表示遍历完毕
+        with self._lock:
+            self.walkers.append(MountWalker(self, root, dev, self.device_limit(dev)))
+
+    def mounts(self) -> List[MountWalker]:
+        """当前已登记的遍历线程（快照）。"""
+        with self._lock:
+            return list(self.walkers)
+
+    @property
+    def seen(self) -> int:
+        return sum(w.seen for w in self.mounts())
+
+    @property
+    def skipped(self) -> int:
+        return sum(w.skipped for w in self.mounts())
+
+    @property
+    def cached(self) -> int:
+        return sum(w.cached for w in self.mounts())
+
+    @property
+    def finished(self) -> bool:
+        """遍历结束后 seen 即为待检媒体文件总数。"""
+        return all(w.finished for w in self.mounts())
+
+    def drained(self) -> bool:
+        """遍历已结束且所有队列均已取空。"""
+        walkers = self.mounts()
+        # 先确认各线程已结束、再看队列：结束前入队的文件不会被漏看
+        return all(w.finished for w in walkers) and all(w.queue.empty() for w in walkers)
+
+
+class DeviceScheduler:
+    """在各挂载点的队列之间轮流取用待检文件，并按设备（st_dev）限制同时在途的文件数。
+
+    机械硬盘各自限制同时在途的文件数（见 FileFeeder.device_limit；并发随机读只会让磁头来回寻道），
+    其他设备不设上限。某个设备已满额或暂无文件时直接轮到下一个，一块慢盘（如 USB 移动硬盘）
+    既不会占满全部线程，也不会因为遍历顺序而让其他盘上的文件排在它后面。
+    """
+
+    def __init__(self, feeder: FileFeeder):
+        self._feeder = feeder
+        self._next = 0
+        self._inflight: Dict[int, int] = {}
+
+    def next_ready(self) -> Optional[WorkItem]:
+        """取下一个可立即提交的文件；所有队列均为空或所在设备均已满额时返回 None。"""
+        walkers = self._feeder.mounts()
+        n = len(walkers)
+        for i in range(n):
+            w = walkers[(self._next + i) % n]
+            if w.limit is not None and self._inflight.get(w.dev, 0) >= w.limit:
+                continue
             try:
-                files.append(Path(dirpath) / fn)
-            except Exception:
-                # 防御性处理异常文件名
-                pass
-    return files
+                item = w.queue.get_nowait()
+            except queue.Empty:
+                continue
+            self._next = (self._next + i + 1) % n  # 下次从下一个挂载点开始，实现轮询
+            self._inflight[item.dev] = self._inflight.get(item.dev, 0) + 1
+            return item
+        return None
+
+    def release(self, item: WorkItem) -> None:
+        self._inflight[item.dev] -= 1
 
 
-def format_progress(done: int, total: int, ok: int, bad: int) -> str:
+def format_progress(done: int, total: int, ok: int, bad: int, final: bool = True) -> str:
+    if not final:
+        # 遍历尚未结束，总数未知：显示“已完成/已发现?”
+        return f"\r进度: {done}/{total}? | OK: {ok} | 损坏: {bad}"
     pct = (done / total * 100) if total else 100.0
     return f"\r进度: {done}/{total} ({pct:5.1f}%) | OK: {ok} | 损坏: {bad}"
 
+
+class ProgressPrinter:
+    """单行覆盖式进度输出，刷新频率限制在约 10 Hz，避免小文件快速扫描时频繁写终端。
+    输出不是终端（重定向到文件/管道）时不做中间刷新，只在结束时写一次。
+    """
+
+    INTERVAL = 0.1
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self.interactive = self.stream.isatty()
+        self._last_ts = 0.0
+        self._last_len = 0
+
+    def due(self) -> bool:
+        if not self.interactive:
+            return False
+        now = time.monotonic()
+        if now - self._last_ts < self.INTERVAL:
+            return False
+        self._last_ts = now
+        return True
+
+    def write(self, line: str) -> None:
+        # 以空格补齐到上一次的长度，覆盖较长旧行的残留字符；整行一次写出
+        self.stream.write(line.ljust(self._last_len))
+        self.stream.flush()
+        self._last_len = len(line)
+
 # ----------------------------- 主程序 -----------------------------
 
 def main():
@@ -268,78 +1100,154 @@ def main():
     parser.add_argument('--timeout', type=int, default=120, help='单文件超时（秒）')
     parser.add_argument('--include-exts', type=str, default='', help='自定义扩展名（逗号分隔），例如: .jpg,.png,.mp4')
     parser.add_argument('--list-damaged', action='store_true', help='结束后列出损坏文件详情')
+    parser.add_argument('--ffmpeg-threads', type=int, default=0,
+                        help='slow 模式下每个 ffmpeg 的解码线程数（默认 0：交由 ffmpeg 自动决定）')
+    parser.add_argument('--strict-metadata', action='store_true',
+                        help='medium/slow 模式下仍单独执行 ffprobe/exiftool 容器与元数据探测')
+    parser.add_argument('--cache-db', type=str, default=DEFAULT_CACHE_DB,
+                        help='结果缓存数据库路径；未变化且上次 OK 的文件直接跳过')
+    parser.add_argument('--no-cache', action='store_true', help='不使用结果缓存')
+    parser.add_argument('--hdd-parallelism', type=int, default=2,
+                        help='每块机械硬盘同时在检的文件数上限（0 表示不限制）')
+    parser.add_argument('--mem-limit', type=int, default=0,
+                        help='单个外部工具进程的内存上限（MB，0 表示不限制）')
+    parser.add_argument('--evict-cache', action='store_true',
+                        help='每个文件检测完后丢弃其页缓存（posix_fadvise DONTNEED），避免挤占宿主机缓存')
+    parser.add_argument('--pyav', action='store_true',
+                        help='fast 探测改用 PyAV 进程内打开容器（更快；但不受超时约束、崩溃会终止扫描、判定较 ffprobe 宽松）')
 
     args = parser.parse_args()
 
+    global MEM_LIMIT_BYTES, USE_PYAV
+    MEM_LIMIT_BYTES = max(0, args.mem_limit) * 1024 * 1024
+    if args.pyav and not HAS_PYAV:
+        print("未安装 PyAV（pip install av），--pyav 无效，fast 探测仍使用 ffprobe\n")
+    USE_PYAV = args.pyav and HAS_PYAV
+
+    # Path 仅用于启动时的规范化与展示；遍历与检测全程使用字符串路径
     root = Path(args.root).expanduser().resolve()
     if not root.exists() or not root.is_dir():
         print(f"根目录不存在或不可用：{root}")
         sys.exit(2)
+    root_str = str(root)
 
     # 工具提示
     print("外部工具可用性：")
     print(f"  ffprobe:   {'OK' if HAS_FFPROBE else 'MISSING'}")
     print(f"  ffmpeg:    {'OK' if HAS_FFMPEG else 'MISSING'}")
     print(f"  exiftool:  {'OK' if HAS_EXIFTOOL else 'MISSING'}")
+    print(f"  PyAV:      {('OK' if USE_PYAV else 'OK（未启用，见 --pyav）') if HAS_PYAV else 'MISSING（可选）'}")
 
     # 依据提示
-    basis = {'fast': FAST_BASIS, 'medium': MEDIUM_BASIS, 'slow': SLOW_BASIS}[args.mode]
+    basis = MODE_BASIS[args.mode]
     print(f"\n检测模式：{args.mode}\n依据：{basis}\n")
 
-    # 扩展名集合
+    # 扩展名集合：图片与视频走同一套检测流程，合并为一个集合只做一次成员判断
+    # --include-exts 一旦指定即作为唯一的白名单
+    global MEDIA_EXTS
     if args.include_exts:
-        exts = {e.strip().lower() if e.strip().startswith('.') else f'.{e.strip().lower()}' for e in args.include_exts.split(',') if e.strip()}
-        image_exts = exts
-        video_exts = exts
+        MEDIA_EXTS = frozenset(e.strip().lower() if e.strip().startswith('.') else f'.{e.strip().lower()}' for e in args.include_exts.split(',') if e.strip())
     else:
-        image_exts = DEFAULT_IMAGE_EXTS
-        video_exts = DEFAULT_VIDEO_EXTS
-
-    # 收集文件
-    all_files = iter_files(root)
-    total = len(all_files)
-    if total == 0:
-        print('未找到任何文件。')
-        return
+        MEDIA_EXTS = DEFAULT_IMAGE_EXTS | DEFAULT_VIDEO_EXTS
 
-    print(f"待检文件总数：{total}（其中将按扩展名过滤图片/视频）\n")
+    cache: Optional[ResultCache] = None
+    if not args.no_cache:
+        try:
+            cache = ResultCache(os.path.expanduser(args.cache_db))
+        except (OSError, sqlite3.Error) as e:
+            print(f"结果缓存不可用，本次不使用缓存：{e}\n")
 
     checked = 0
     ok_count = 0
     bad_count = 0
-    damaged_list: List[FileResult] = []
+    damaged = DamagedTable()
 
-    # 任务提交
+    # 任务提交：只保持有限个任务在途（workers 的数倍，保证线程不空转），
+    # 完成一个补交一个，而不是一次性为所有文件创建 Future
+    max_inflight = args.workers * 4
+    profile = cache_profile(args.mode, args.strict_metadata, USE_PYAV)
+    feeder = FileFeeder(root_str, maxsize=max_inflight, cache=cache, profile=profile,
+                        hdd_parallelism=args.hdd_parallelism)
+    scheduler = DeviceScheduler(feeder)
+    # 遍历途中发现的其他挂载点在汇总中列出
+    print(f"按设备的并发上限（--hdd-parallelism {args.hdd_parallelism}，--workers {args.workers}）：")
+    print(feeder.mounts()[0].describe() + "\n")
+    print("开始扫描（边遍历边检测，遍历完成前总数显示为“已发现?”）\n")
+    pending: Dict[futures.Future, WorkItem] = {}
+    progress = ProgressPrinter()
+    # 本次扫描不变的参数预先绑定，提交时只传逐文件参数
+    check = functools.partial(audit_one, mode=args.mode, timeout=args.timeout,
+                              strict_metadata=args.strict_metadata, ffmpeg_threads=args.ffmpeg_threads,
+                              evict_cache=args.evict_cache)
     with futures.ThreadPoolExecutor(max_workers=args.workers) as ex:
-        future_map = {}
-        for p in all_files:
-            future = ex.submit(audit_one, p, args.mode, args.timeout, image_exts, video_exts)
-            future_map[future] = p
-
         try:
-            for fut in futures.as_completed(future_map):
-                res: FileResult = fut.result()
-                checked += 1
-
-                if res.status == 'ok' or (res.ok and res.status == 'skipped'):
-                    ok_count += 1
-                elif res.status in ('damaged', 'error'):
-                    bad_count += 1
-                    damaged_list.append(res)
-                # 进度条（单行覆盖输出）
-                print(format_progress(checked, total, ok_count, bad_count), end='', flush=True)
+            while True:
+                feeder.arrived.clear()
+                while len(pending) < max_inflight:
+                    item = scheduler.next_ready()
+                    if item is None:
+                        break
+                    pending[ex.submit(check, item.path, item.ext, header=item.header)] = item
+
+                if pending:
+                    # 仍有空位且遍历未结束时限时等待：其他挂载点上新发现的文件可随时补位，不必等在途文件完成
+                    wait_timeout = None if len(pending) >= max_inflight or feeder.finished else ProgressPrinter.INTERVAL
+                    done, _ = futures.wait(pending, timeout=wait_timeout, return_when=futures.FIRST_COMPLETED)
+                elif feeder.drained():
+                    break
+                else:
+                    # 各队列暂时为空：等待遍历线程送来新文件
+                    feeder.arrived.wait(ProgressPrinter.INTERVAL)
+                    done = set()
+
+                for fut in done:
+                    item = pending.pop(fut)
+                    scheduler.release(item)
+                    row: AuditRow = fut.result()
+                    checked += 1
+                    if cache is not None and item.stamp is not None:
+                        cache.record(row[0], item.stamp, profile, row[1], row[2])
+
+                    status = row[1]
+                    if status == STATUS_OK or status == STATUS_SKIPPED:
+                        ok_count += 1
+                    else:
+                        bad_count += 1
+                        damaged.append(row)
+                # 进度条（单行覆盖输出，限频）
+                if progress.due():
+                    progress.write(format_progress(checked, feeder.seen, ok_count, bad_count, feeder.finished))
         finally:
+            progress.write(format_progress(checked, feeder.seen, ok_count, bad_count, feeder.finished))
             print()  # 换行
+            shutdown_exiftool_daemons()
+            if cache is not None:
+                cache.close()
+
+    # 跳过的文件（扩展名不符）与缓存命中的文件仍计入“OK/跳过”，与逐个检测时的统计口径一致
+    total = feeder.seen + feeder.skipped + feeder.cached
+    if total == 0:
+        print('未找到任何文件。')
+        return
 
     # 汇总报告
     print('\n==== 检测完成 ====')
     print(f"根目录：{root}")
     print(f"模式：{args.mode}")
-    print(f"总数：{total} | OK/跳过：{ok_count} | 损坏/错误：{bad_count}")
+    print(f"总数：{total} | OK/跳过：{ok_count + feeder.skipped + feeder.cached} | 损坏/错误：{bad_count}")
+    if feeder.cached:
+        print(f"其中 {feeder.cached} 个文件自上次检测后未变化，沿用缓存结果（OK）")
+    mounts = feeder.mounts()
+    if len(mounts) > 1:
+        print("按设备的并发上限：")
+        for w in mounts:
+            print(w.describe())
+    if cache is not None and cache.error is not None:
+        print(f"结果缓存写入失败，此后的检测结果未保存：{cache.error}")
 
-    if args.list_damaged and damaged_list:
+    if args.list_damaged and damaged:
         print('\n-- 损坏/错误文件清单 --')
-        for r in damaged_list:
+        for r in damaged.results(args.mode):
             # 仅读输出，包含原因摘要
             print(f"[DAMAGED] {r.path} | {r.reason}")
 